@@ -1,3 +1,52 @@
+import concurrent.futures
+import functools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import timeit
+
+# True on free-threaded builds of python with the GIL actually disabled; only
+# then can threads run big integer arithmetic at the same time
+_GIL_DISABLED = not getattr(sys, '_is_gil_enabled', lambda: True)()
+
+# gmpy2 is optional; GMP's division, square root and base conversion are far
+# faster than anything that can be done in python, so when it's installed the
+# public functions just hand their (type checked) arguments over to it
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+# cupy is optional; when it is installed and there is a gpu to run it on, the
+# largest multiplications of the reciprocal computation are done on the gpu.
+# Those only come up for huge numbers, so cupy is not imported here but by
+# _cupyModules the first time a multiplication is big enough (importing it and
+# initializing CUDA is slow, and would leave fork()ed children unable to use
+# CUDA)
+
+# below these sizes (the bit length of the divisor for the division, and of the
+# argument for the square root and base 10 conversion) the builtin int
+# operations are used; these are about where the recursive algorithms were
+# measured to start winning, and _calibrate can measure them for a particular
+# machine (see the end of this file)
+_DIVMOD_BAILOUT_BITS = 4096
+_SQRT_BAILOUT_BITS = 4096
+_STR_BAILOUT_BITS = 20000
+
+# _POWERS[k] is 10**(2**k); the powers found for one base 10 conversion are
+# kept for the next so that they only have to be computed once (see
+# _powerOfTen)
+_POWERS = [10]
+_POWERS_LOCK = threading.Lock()
+
+# where the thresholds measured by _calibrate are saved
+_THRESHOLDS_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+    'pyfastbigint_thresholds.json')
+
 def fastBigIntDivMod(m, n):
     '''compute the quotient and module of m by n; functionally equivalent to the
     python divmod function for integer arguments, but internally uses more
@@ -7,6 +56,15 @@ def fastBigIntDivMod(m, n):
 
     if not isinstance(m, int) or not isinstance(n, int):
         raise TypeError("fastBigIntDivMod expected int arguments")
+
+    if gmpy2 is not None:
+        # for divisors below ~768 bits, converting to and from gmpy2's mpz
+        # costs more than the native division itself
+        if n.bit_length() < 768:
+            return divmod(m, n)
+
+        q,r = gmpy2.f_divmod(m, n)
+        return int(q),int(r)
     
     q,r = _divModPositiveArgs(abs(m), abs(n))
     if m > 0 and n > 0:
@@ -27,32 +85,28 @@ def fastBigIntStrBase10(n):
     calling str on an integer, but internally uses the fast divmod function to
     accelerate the conversion; this is the outer function that handles the sign
     of the argument and typechecking; the core logic is wrapped inside the call
-    to _toBase10StringHelper'''
+    to _toBase10String'''
 
     if not isinstance(n, int):
         raise TypeError(f"fastBigIntStrBase10 expected int argument")
 
+    if gmpy2 is not None:
+        # the same goes for the conversion of numbers below ~512 bits
+        if n.bit_length() < 512:
+            return str(n)
+
+        return gmpy2.mpz(n).digits(10)
+
     if n == 0:
         return '0'
     elif n < 0:
         return '-' + fastBigIntStrBase10(-n)
 
-    # generate a list of 10 ** (2*n) to use as divisors
-    powers = [10]
-    while powers[-1].bit_length() * 2 < n.bit_length():
-        powers.append(powers[-1]*powers[-1])
-    
-    # perform the conversion and strip leading zeros
-    chars = _toBase10StringHelper(n, powers, len(powers))
-    for i,c in enumerate(chars):
-        if c != '0':
-            break
-    
-    return chars[i:]
+    return _toBase10String(n)
 
 def fastBigIntFloorSqrt(n):
     '''Compute the floor of the square root of n; this function performs input
-    checking and then calls _floorSqrtPositiveInt which implements the core
+    checking and then calls _sqrtRemPositiveInt which implements the core
     logic'''
 
     if not isinstance(n, int):
@@ -60,9 +114,34 @@ def fastBigIntFloorSqrt(n):
     if n < 0:
         raise ValueError(f"fastBigIntFloorSqrt domain error (less than zero)")
 
-    return _floorSqrtPositiveInt(n)
+    if gmpy2 is not None:
+        return int(gmpy2.isqrt(n))
+
+    # small enough for the native square root; there's no need for the remainder
+    # that _sqrtRemPositiveInt would compute along with it
+    if n.bit_length() < _SQRT_BAILOUT_BITS:
+        return math.isqrt(n)
+
+    return _sqrtRemPositiveInt(n)[0]
+
+def fastBigIntSqrtRem(n):
+    '''Compute the floor of the square root of n along with the remainder,
+    returning a tuple (s, r) such that s*s + r == n; this function performs
+    input checking and then calls _sqrtRemPositiveInt which implements the
+    core logic'''
+
+    if not isinstance(n, int):
+        raise TypeError(f"fastBigIntSqrtRem expected int argument")
+    if n < 0:
+        raise ValueError(f"fastBigIntSqrtRem domain error (less than zero)")
+
+    if gmpy2 is not None:
+        s,r = gmpy2.isqrt_rem(n)
+        return int(s),int(r)
+
+    return _sqrtRemPositiveInt(n)
 
-def _divModPositiveArgs(m, n):
+def _divModPositiveArgs(m, n, m_len=None, n_len=None):
     '''The core function division/modulo; this assumes positive arguments, so use the top
     level fastBigIntDivMod for general purpose use.
     
@@ -90,14 +169,24 @@ def _divModPositiveArgs(m, n):
     nice little improvement, and it shows for very large integers. However, this is still a lot
     worse than a dedicated big number library (i.e. GMP).
     
-    For small values of n (currently less than 10000 bits) this function bails out to use the
-    native python divmod method as the speed of native code will outpace the algorithmic benefits.
+    For small values of n (less than _DIVMOD_BAILOUT_BITS, currently 4096 bits) this function
+    bails out to use the native python divmod method as the speed of native code will outpace
+    the algorithmic benefits. The native division is quadratic, but its inner loop is a tight
+    multiply and subtract loop in C, which no python level loop over machine words can compete
+    with; so the best way to make the base case cheap is to get to it with small operands: a
+    4096 bit divisor (64 machine words) was measured to be about where the recursion starts to
+    beat the native division.
+
+    The recursive calls already know the bit lengths of the pieces they split off, so they
+    pass them in as m_len and n_len rather than having them computed again.
     '''
     
-    m_len = m.bit_length()
-    n_len = n.bit_length()
+    if m_len is None:
+        m_len = m.bit_length()
+    if n_len is None:
+        n_len = n.bit_length()
 
-    if n.bit_length() < 10000:
+    if n_len < _DIVMOD_BAILOUT_BITS:
         # bailout to native case
         
         return divmod(m, n)
@@ -112,18 +201,11 @@ def _divModPositiveArgs(m, n):
         # When they have the same log2 magnitude, there are really only two possibilities:
         #   n > m, see above case
         #   n <= m < 2*n, m // n is 1
-        # Just in case I screwed up this logic, we do the simple thing and just keep reducing
-        # the remainder by n until it's less than n; this while loop should never run more
-        # than once though
         
-        q = 0
-        r = m
-
-        while r >= n:
-            r -= n
-            q += 1
+        if m >= n:
+            return 1, m - n
         
-        return q, r
+        return 0, m
     
     elif m_len < 2 * n_len:
         # In this case, we know that m > n, but m is not large enough to satisfy the condition
@@ -138,10 +220,11 @@ def _divModPositiveArgs(m, n):
         #   mmmmmmmmmm  mmmmmmmmmmmmm
         #        nnnnn  nnnnnnnnnnnnn
         #
-        # The division of m_hi // n_hi will be a really good approximation of m // n (probably
-        # 1 or 2 off at most -- I'm too lazy to work out the exact worst case error). Whatever
-        # the error is, we then just correct the quotient up or down by 1 until the remainder
-        # falls into the correct range (0 <= remainder < n).
+        # The division of m_hi // n_hi will be a really good approximation of m // n: it can
+        # never be too small (dropping the bottom bits of n can only make it smaller, which
+        # makes the quotient larger), and since n_hi >= 2**(k-1) and m_hi < 2**(2*k) it is at
+        # most 4 too large. _correctDivMod then fixes the quotient and remainder with a bounded
+        # amount of work.
         
         k = m_len - n_len
         excess_bits = n_len - k
@@ -149,22 +232,12 @@ def _divModPositiveArgs(m, n):
         m_hi, m_lo = _splitHiLo(m, excess_bits)
         n_hi, n_lo = _splitHiLo(n, excess_bits)
 
-        if n_hi == 0:
-            print(m, n)
-
-        q,r = _divModPositiveArgs(m_hi, n_hi)
+        q,r = _divModPositiveArgs(m_hi, n_hi, 2 * k, k)
         
         # r = m - n*q
         r = ((r << excess_bits) | m_lo) - n_lo * q
 
-        while r < 0:
-            r += n
-            q -= 1
-        while r >= n:
-            r -= n
-            q += 1
-
-        return q,r
+        return _correctDivMod(q, r, n)
     
     elif m_len == 2 * n_len:
         # the ideal case
@@ -182,6 +255,12 @@ def _divModPositiveArgs(m, n):
         # again by approximating with an 8-bit by 4-bit division first and then
         # correcting. Finally, we take the 2nd remainder and concatonate the
         # quotients of the two computations for the overall result
+        #
+        # Both approximations are never too small and at most a few too large
+        # for the same reasons as in the m_len < 2 * n_len case, so each gets a
+        # single bounded correction; when k is odd, the bottom half has one more
+        # bit than the top half of n, so the second estimate also brings in the
+        # top bit of the bottom half next to the first remainder
         
         k = n_len
         kh_floor = k // 2
@@ -191,31 +270,19 @@ def _divModPositiveArgs(m, n):
         m_mid, m_lo = _splitHiLo(m_mid, kh_ceil)
         n_hi, n_lo = _splitHiLo(n, kh_floor)
 
-        q1, r1 = _divModPositiveArgs(m_hi, n_hi)
+        q1, r1 = _divModPositiveArgs(m_hi, n_hi, k, kh_ceil)
 
-        # r1 = {m_hi, m_lo} - (q1 * n)
+        # r1 = {m_hi, m_mid} - (q1 * n)
         r1 = ((r1 << kh_floor) | m_mid) - n_lo * q1
-
-        while r1 < 0:
-            r1 += n
-            q1 -= 1
-        while r1.bit_length() >= k:
-            r1 -= n
-            q1 += 1
+        q1, r1 = _correctDivMod(q1, r1, n)
         
-        q2, r2 = _divModPositiveArgs(r1, n_hi)
-        if k & 1:
-            q2 <<= 1
+        m_lo_hi, m_lo = _splitHiLo(m_lo, kh_floor)
+        q2, r2 = _divModPositiveArgs((r1 << (kh_ceil - kh_floor)) | m_lo_hi, n_hi,
+            None, kh_ceil)
 
         # r2 = (r1 << kh_ceil | m_lo) - n * q2
-        r2 = ((r2 << kh_ceil) | m_lo) - n_lo * q2
-
-        while r2 < 0:
-            r2 += n
-            q2 -= 1
-        while r2 >= n:
-            r2 -= n
-            q2 += 1
+        r2 = ((r2 << kh_floor) | m_lo) - n_lo * q2
+        q2, r2 = _correctDivMod(q2, r2, n)
         
         q = (q1 << kh_ceil) + q2
 
@@ -233,11 +300,21 @@ def _divModPositiveArgs(m, n):
     # I think this is a bit more efficient since right padding immediately creates
     # a big number which takes up a lot of memory)
 
-    k = n.bit_length()
+    k = n_len
+
+    if m_len > 16 * k and k < (1 << 17):
+        # with this many steps it can pay to compute a reciprocal of n once and
+        # reuse it for every step (see _divModWithInv); however computing the
+        # reciprocal costs about as much as one 2k by k division, and a step
+        # using it was only measured to be faster (by 5-25%) than a recursive
+        # division for divisors below ~100000 bits; outside that window the
+        # plain recursive division below wins
+        return _divModWithInv(m, n, _shiftedInverse(n, 2 * k), 2 * k)
+
     q = 0
     r = m
-    remainingBits = r.bit_length() - 2 * k
-    while r > n:
+    remainingBits = m_len - 2 * k
+    while r >= n:
         newRemainingBits = max(r.bit_length() - 2 * k, 0)
         bitsProcessed = remainingBits - newRemainingBits
         remainingBits = newRemainingBits
@@ -246,7 +323,7 @@ def _divModPositiveArgs(m, n):
 
         r_hi, r_lo = _splitHiLo(r, remainingBits)
 
-        qi, r = _divModPositiveArgs(r_hi, n)
+        qi, r = _divModPositiveArgs(r_hi, n, None, k)
         r = (r << remainingBits) | r_lo
 
         q += qi
@@ -254,83 +331,556 @@ def _divModPositiveArgs(m, n):
     q <<= remainingBits
     return q, r
 
-def _toBase10StringHelper(n, powers, digitsLog2):
-    '''calculate the decimal representation of n; powers must be the list of
-    values of the form 10**(2**n) such that the largest value is at least the
-    square root of n; digitsLog2 is the log 2 of the number of decimal digits to
-    produce, and the result string will be left padded with ascii 0; note that
-    it should satisfy n < 10**(2**digitsLog2).
+def _divModWithInv(m, n, w, h):
+    '''Division/modulo of positive m by n using a precomputed reciprocal
+    w = _shiftedInverse(n, h), where h must be 2 * n.bit_length(); callers that
+    divide many numbers by the same n can compute w once and pay only two
+    multiplications per division afterwards.
+
+    If we let k=n.bit_length(), then for m < 2**h this is Barrett's reduction:
+    w is 2**(2*k) / n rounded down, so m * w / 2**(2*k) approximates m / n. It
+    is enough to multiply w by the top k+1 bits of m, which keeps both factors
+    about k bits long; the resulting quotient estimate is never too large and
+    at most 2 too small, so the remainder m - q*n is fixed up by _correctDivMod.
+
+    Larger values of m are handled with long division in base 2**bits, where
+    bits is k rounded down to a whole number of bytes: each step brings down
+    the next bits bits of m next to the previous remainder (which is less than
+    n) so every partial dividend is less than 2**h and can be reduced with the
+    single step above using the same w. Each quotient digit is less than
+    2**bits, so the digits can be written out as bytes and turned into the
+    quotient all at once at the end; shifting the digits into the quotient
+    (and splitting them off of m) one at a time would copy the growing
+    quotient (and the shrinking rest of m) on every step, which for a long
+    quotient costs more than the divisions themselves'''
+
+    k = n.bit_length()
+    m_len = m.bit_length()
+
+    if m_len <= h:
+        q = ((m >> (k - 1)) * w) >> (k + 1)
+        return _correctDivMod(q, m - n * q, n)
+
+    if k < 8:
+        # there's no whole byte of digit to bring down; divisors this small are
+        # much better off with the native division anyway
+        return divmod(m, n)
+
+    bits = k & ~7
+    digitBytes = bits >> 3
+
+    # the number of full digits below the top part of m, which is kept to
+    # less than 2**h so that it can be reduced in one step too
+    digits = (m_len - h + bits - 1) // bits
+
+    data = m.to_bytes((m_len + 7) >> 3, 'big')
+    topBytes = len(data) - digits * digitBytes
+    q, r = _divModWithInv(int.from_bytes(data[:topBytes], 'big'), n, w, h)
+
+    data = memoryview(data)
+    qDigits = []
+    for i in range(topBytes, len(data), digitBytes):
+        qi, r = _divModWithInv((r << bits) | int.from_bytes(data[i:i + digitBytes], 'big'),
+            n, w, h)
+        qDigits.append(qi.to_bytes(digitBytes, 'big'))
+
+    q = (q << (digits * bits)) | int.from_bytes(b''.join(qDigits), 'big')
+    return q, r
+
+def _shiftedInverse(v, h, backend=None):
+    '''compute the shifted inverse 2**h // v of a positive integer v, which is
+    the reciprocal of v scaled up to an integer; combined with _divModWithInv
+    this turns a division by v into multiplications.
+
+    The core of the work is done by _approxShiftedInverse, which only handles
+    the normalized case h == 2 * v.bit_length() and may be off by one; other
+    values of h are reduced to that case, and the approximation is checked and
+    corrected by computing the remainder 2**h - v*w.
+
+    backend selects how the large multiplications are done: 'int' always uses
+    python ints, and 'cupy' uses FFT multiplication on the gpu when cupy and a
+    gpu are available (see _multiply); None is the same as 'cupy'''
+
+    if backend is None:
+        backend = 'cupy'
+
+    k = v.bit_length()
+
+    # 2**h // v == 2**(2*(k+s)) // (v << s) where s makes the shift normalized
+    s = h - 2 * k
+    if s > 0:
+        v <<= s
+        k += s
+
+    w = _approxShiftedInverse(v, k, backend)
+    w, _ = _correctDivMod(w, (1 << (2 * k)) - _multiply(v, w, backend), v)
+
+    if s < 0:
+        # floor(floor(x / a) / b) == floor(x / (a*b)), so dropping the extra
+        # bits of the normalized inverse gives the requested one exactly
+        w >>= -s
+
+    return w
+
+def _approxShiftedInverse(v, k, backend='int'):
+    '''approximate 2**(2*k) // v for a positive v with k bits, to within about
+    1 (use _shiftedInverse for the exact value).
     
-    Theory of operation: we recursively break down the conversion problem by
-    dividing by a large power of then, converting the quotient and remainder to
-    decimal, and then concatenating the results; the powers list is provided so
-    that we have precomputed values for the powers of 10 to divide by, and by
-    being of powers of 2 number of digits, we can recursively split the problem
-    in half; when we get to the point where the number is less than 20000 binary
-    digits, we just use the python native str function as this is efficient for
-    small integers'''
-
-    if n.bit_length() < 20000:
-        chars = str(n)
-
-        # left pad with zeros to the expected number of digits; this way if we
-        # are computing the rhs which will then be concatenated, we will produce
-        # the correct amount of separating zeros
-        return '0' * ((1 << digitsLog2) - len(chars)) + chars
-
-    # split the number by a power of ten, concatenate the converted quotient
-    # and remainder
-    lhs, rhs = _divModPositiveArgs(n, powers[digitsLog2-1])
-    return (_toBase10StringHelper(lhs, powers, digitsLog2-1) +
-        _toBase10StringHelper(rhs, powers, digitsLog2-1))
-
-def _floorSqrtPositiveInt(n):
-    '''calculate the floor of the sqrt of an integer; this function expects a
-    positive integer (use fastBigIntFloorSqrt if you wanttype & value checking).
-    This basically uses Newton's method recursively; since Newton's method
-    acheives exponentially more digits each iteration (in fact normally double
-    the digits) we only use half the digits each iteration to approximate the
-    square root, perform one iteration, and then correct up or down by one until
-    we have the result exactly'''
-
-    # for really small ints (128 or less) we just brute force it
-    if n.bit_length() <= 1:
-        return n
-    elif n.bit_length() < 8:
-        s = 1
-        while (s+1)*(s+1) <= n:
-            s += 1
-        return s
-
-    # calculate an approximation by using only half of the bits
-    resultPadBits = n.bit_length() // 4
-    padBits = 2 * resultPadBits
-    approx = _floorSqrtPositiveInt(n >> padBits) << resultPadBits
-
-    # refine the approximation with one iteration of newtons method
-    approx = (approx + _divModPositiveArgs(n, approx)[0]) >> 1
-
-    # add or subract 1 until the approximation is exact; this should only run
-    # 1 or 2 correction iterations maxs
-    actualSquare = approx * approx
-    if actualSquare > n:
-        approx -= 1
-        actualSquare -= ((approx << 1) | 1)
-        while actualSquare > n:
-            approx -= 1
-            actualSquare -= ((approx << 1) | 1)
+    This is Newton's iteration for the reciprocal, w' = w + w*(1 - v*w), done
+    in integers: an inverse of the top half of the bits of v gives half of the
+    bits of the result, and one Newton step doubles the number of correct bits.
+    So we recurse on the top k/2 bits of v (plus a few guard bits so that the
+    truncation error stays well below one unit of the result) until v fits in
+    a few machine words and the native division is cheap. Since only the
+    leading bits of the Newton correction term are needed, the error term is
+    truncated before its multiplication, which means each step costs about
+    one k by k/2 multiplication and one k/2 by k/2 multiplication; backend is
+    passed on to _multiply for those'''
+
+    if k <= 256:
+        return (1 << (2 * k)) // v
+
+    kh = k // 2 + 16
+    t = k - kh
+
+    # wh ~= 2**(2*kh) / v_hi, so (wh << t) is a half precision estimate of the
+    # result; e is the scaled error of that estimate: 2**(2*k-t) - v*wh
+    wh = _approxShiftedInverse(v >> t, kh, backend)
+    e = (1 << (2 * kh + t)) - _multiply(v, wh, backend)
+
+    # the newton step w = (wh << t) + (wh * e >> 2*kh), where the lowest bits
+    # of e are dropped before the multiplication since they can't affect the
+    # result by more than a fraction of a unit
+    c = max(t - 8, 0)
+    return (wh << t) + (_multiply(wh, e >> c, backend) >> (2 * kh - c))
+
+def _multiply(a, b, backend):
+    '''multiply two ints; with backend 'cupy', both operands over 2**20 bits
+    (below that, copying to and from the gpu costs more than python's own
+    multiplication) and a gpu to use, the product is computed on the gpu by
+    _cupyMultiplyPositive, otherwise this is just a * b'''
+
+    if (backend != 'cupy' or min(a.bit_length(), b.bit_length()) <= (1 << 20)
+            or _cupyModules() is None):
+        return a * b
+
+    product = _cupyMultiplyPositive(abs(a), abs(b))
+    return -product if (a < 0) != (b < 0) else product
+
+@functools.lru_cache(maxsize=None)
+def _cupyModules():
+    '''return the tuple (cupy, numpy) if cupy is installed and there is a gpu
+    for it to use, or None otherwise; this is only checked once'''
+
+    try:
+        import cupy
+        import numpy
+        cupy.cuda.runtime.getDeviceCount()
+    except Exception:
+        return None
+
+    return cupy, numpy
+
+def _cupyMultiplyPositive(a, b):
+    '''multiply two positive ints on the gpu with cupy, by convolving their
+    bytes with floating point FFTs; this needs three FFTs, the same as a
+    Schonhage-Strassen style multiplication.
+
+    The pieces are kept to 8 bits so that the terms of the convolution (each a
+    sum of up to min(len) products of two bytes) stay far enough below the
+    53 bit precision of a double that rounding the inverse FFT gives them
+    exactly. Rather than propagating the carries between the terms one by one,
+    the terms are split into their bytes on the gpu: the j-th bytes of all the
+    terms together form a byte string whose value goes into the product
+    shifted by j bytes, so the host only has to add a few byte strings'''
+
+    cupy, numpy = _cupyModules()
+
+    la = (a.bit_length() + 7) >> 3
+    lb = (b.bit_length() + 7) >> 3
+    size = 1 << (la + lb - 1).bit_length()
+
+    fa = cupy.fft.rfft(cupy.asarray(numpy.frombuffer(a.to_bytes(la, 'little'),
+        dtype=numpy.uint8), dtype=cupy.float64), size)
+    fb = cupy.fft.rfft(cupy.asarray(numpy.frombuffer(b.to_bytes(lb, 'little'),
+        dtype=numpy.uint8), dtype=cupy.float64), size)
+    terms = cupy.rint(cupy.fft.irfft(fa * fb, size)[:la + lb]).astype(cupy.int64)
+
+    product = 0
+    termBytes = ((min(la, lb) * 255 * 255).bit_length() + 7) >> 3
+    for j in range(termBytes):
+        piece = ((terms >> (8 * j)) & 0xff).astype(cupy.uint8)
+        product += int.from_bytes(cupy.asnumpy(piece).tobytes(), 'little') << (8 * j)
+
+    return product
+
+def _toBase10String(n):
+    '''convert a positive integer to a base 10 string with the divisions in
+    this file (fastBigIntStrBase10 does the type checking and hands the work
+    to gmpy2 when it can); this sets up the divisors and the output buffer for
+    _toBase10StringHelper, which does the actual conversion'''
+
+    # generate a list of 10 ** (2**k) to use as divisors
+    powers = [(10, None, None)]
+    while powers[-1][0].bit_length() * 2 < n.bit_length():
+        powers.append((_powerOfTen(len(powers)), None, None))
+
+    # the divisor at each level of the conversion is used twice as many times
+    # as the one above it, so for all but the top 3 levels (where it would be
+    # used less than 8 times) it pays to also have a reciprocal of the divisor
+    for k in range(len(powers) - 3):
+        powers[k] = _powerOfTenWithInv(k)
+    
+    # perform the conversion into a buffer of ascii zeros and strip leading
+    # zeros; n can be up to 4 times larger than 10**(2**len(powers)), so the
+    # buffer has room for one more digit in front
+    out = bytearray(b'0') * ((1 << len(powers)) + 1)
+
+    cpus = os.cpu_count() or 1
+    if _GIL_DISABLED and cpus > 1 and n.bit_length() >= (1 << 18):
+        # the divisions at each level are independent of each other, so they
+        # can be done in parallel
+        with concurrent.futures.ThreadPoolExecutor(cpus) as pool:
+            _toBase10StringHelper(n, powers, len(powers), out, 1, pool)
     else:
-        actualSquare += ((approx << 1) | 1)
-        while actualSquare <= n:
-            approx += 1
-            actualSquare += ((approx << 1) | 1)       
+        _toBase10StringHelper(n, powers, len(powers), out, 1)
+
+    return out.decode('ascii').lstrip('0')
+
+def _toBase10StringHelper(n, powers, digitsLog2, out, offset, pool=None):
+    '''write the decimal representation of n into the bytearray out; powers
+    must be the list of tuples (p, w, h) where p is 10**(2**k) and w is either
+    None or the reciprocal of p from _shiftedInverse(p, h), such that the
+    largest value is at least the square root of n; digitsLog2 is the log 2 of
+    the number of decimal digits to produce, which are written as ascii to
+    out[offset:offset + 2**digitsLog2]; out must already be filled with ascii 0
+    which then serves as the left padding. Note that it should satisfy
+    n < 10**(2**digitsLog2); a larger n spills digits into out before offset.
+    
+    Theory of operation: we break down the conversion problem by dividing by a
+    large power of ten, so that the quotient and remainder can be converted to
+    decimal separately and written next to each other; by using powers of 10
+    with powers of 2 number of digits, each of those can be split in half the
+    same way, and so on. This is done one level at a time: every part at one
+    level has the same number of digits, so they are all divided by the same
+    power of 10 (and with the same reciprocal, if the powers list has one for
+    that level). When the parts get below _STR_BAILOUT_BITS binary digits, we
+    just use the python native str function as this is efficient for small
+    integers. Writing into one preallocated buffer means the digits are only
+    copied once, rather than once for every level of concatenation.
+
+    The parts at each level are completely independent, so if a thread pool is
+    given, the divisions of each level are spread over the pool (as long as the
+    parts are at least 2**18 bits, where the work outweighs the overhead)'''
+
+    parts = [n]
+    width = 1 << digitsLog2
+
+    # each part is less than 10**width (up to a few bits more for the leading
+    # part), so this is an upper bound on their bit length
+    while (width * 10) // 3 >= _STR_BAILOUT_BITS:
+        p, w, h = powers[digitsLog2-1]
+        if w is None:
+            divide = lambda part: _divModPositiveArgs(part, p)
+        else:
+            divide = lambda part: _divModWithInv(part, p, w, h)
+
+        if pool is not None and (width * 10) // 3 >= (1 << 18):
+            halves = pool.map(divide, parts)
+        else:
+            halves = map(divide, parts)
+
+        # the quotient of each part goes in front of its remainder
+        parts = [half for pair in halves for half in pair]
+        digitsLog2 -= 1
+        width >>= 1
+
+    for i, part in enumerate(parts):
+        chars = str(part).encode('ascii')
+
+        # right align the digits in this part of the buffer; the zeros already
+        # in the buffer pad it to the expected number of digits
+        end = offset + (i + 1) * width
+        out[end - len(chars):end] = chars
+
+def _powerOfTen(digitsLog2):
+    '''return 10**(2**digitsLog2); every power is the square of the one before
+    it, so each one that is needed is appended to _POWERS along with any that
+    are missing below it, and later calls (from any thread) just look them up.
+    The lock makes sure that two threads never both spend time on the same
+    (potentially huge) squaring; it is only taken to extend the list, so that
+    looking up a power that is already there never waits on another thread
+    computing a much larger one (the list only ever grows, so a power that is
+    there stays there)'''
+
+    if digitsLog2 < len(_POWERS):
+        return _POWERS[digitsLog2]
+
+    with _POWERS_LOCK:
+        while len(_POWERS) <= digitsLog2:
+            _POWERS.append(_POWERS[-1] ** 2)
+
+        return _POWERS[digitsLog2]
+
+@functools.lru_cache(maxsize=None)
+def _powerOfTenWithInv(digitsLog2):
+    '''return the tuple (p, w, h) where p = 10**(2**digitsLog2) and w is the
+    reciprocal _shiftedInverse(p, h) that _divModWithInv expects; a reciprocal
+    costs about as much as a division, so we cache these so that they are
+    shared by every division at one level of a base 10 conversion as well as
+    by later conversions of similarly sized numbers'''
+
+    p = _powerOfTen(digitsLog2)
+    h = 2 * p.bit_length()
+    return p, _shiftedInverse(p, h), h
+
+def _sqrtRemPositiveInt(n):
+    '''calculate the floor of the sqrt of an integer along with the remainder,
+    returning (s, r) such that s*s + r == n and 0 <= r <= 2*s; this function
+    expects a positive integer (use fastBigIntSqrtRem if you want type & value
+    checking).
+
+    This is Zimmermann's Karatsuba square root: if we split n into 4 digits of
+    k bits each, n = a3*B**3 + a2*B**2 + a1*B + a0 with B = 2**k, the square
+    root of the top half of the digits (a3*B + a2) gives the top half of the
+    digits of the result, s1, along with a remainder r1. Expanding
+    (s1*B + q)**2 shows that the bottom half q of the result is approximately
+    (r1*B + a1) / (2*s1), so that one half size division gets us the rest of
+    the digits; the remainder then falls out from the remainder of the
+    division without ever squaring the full result:
+        
+        s = s1*B + q
+        r = u*B + a0 - q*q     where (q, u) = divmod(r1*B + a1, 2*s1)
     
-    return approx
+    As long as a3 >= B/4, q is either exact or one too large, which shows up
+    as a negative remainder and is fixed with a single correction. To
+    guarantee that, n is first shifted left by 0 or 2 bits so that its bit
+    length is a multiple of 4 or one less than a multiple of 4, and the result
+    is shifted back at the end. Overall this costs a half size square root, a
+    half size division and a quarter size squaring, so like the division it
+    has the same complexity as the multiplication'''
+
+    # for small ints the native square root is faster
+    if n.bit_length() < _SQRT_BAILOUT_BITS:
+        s = math.isqrt(n)
+        return s, n - s*s
+
+    # normalize so that the top digit a3 is at least B/4
+    t = ((-n.bit_length()) % 4) // 2
+    n_norm = n << (2 * t)
+    k = (n_norm.bit_length() + 1) // 4
+
+    a32, a10 = _splitHiLo(n_norm, 2 * k)
+    a1, a0 = _splitHiLo(a10, k)
+
+    s1, r1 = _sqrtRemPositiveInt(a32)
+    q, u = _divModPositiveArgs((r1 << k) | a1, s1 << 1)
+
+    s = (s1 << k) + q
+    r = ((u << k) | a0) - q * q
+
+    if r < 0:
+        r += (s << 1) - 1
+        s -= 1
+
+    if t:
+        # undo the normalization: if s0 is the bit shifted off of the root, then
+        # n - (s >> 1)**2 == (r + 2*s0*s - s0**2) / 4
+        s0 = s & 1
+        r = (r + ((s << 1) - 1) * s0) >> 2
+        s >>= 1
+
+    return s, r
+
+def _correctDivMod(q, r, n):
+    '''helper function to correct an estimated quotient; given q that is close
+    to m // n and the corresponding remainder r = m - q*n (which may be
+    negative or too large), return the exact quotient and remainder of m by n.
+
+    Adjusting the estimate one step at a time costs a full size addition or
+    subtraction per step; instead the number of multiples of n that r is off by
+    is computed from the top 64 bits of r and n. That count is rounded so it can
+    only be too small, and with 64 bits of precision it is off by at most one,
+    so there is always a single adjustment and at most one more subtraction'''
+
+    if 0 <= r < n:
+        return q, r
+
+    s = n.bit_length() - 64
+    if s <= 0:
+        d, r = divmod(r, n)
+        return q + d, r
+
+    # d is a lower bound on floor(r / n), and with a small |r / n| it's off by
+    # at most 1; the bounds use (n >> s) + 1 > n / 2**s >= n >> s
+    if r < 0:
+        d = (r >> s) // (n >> s)
+    else:
+        d = (r >> s) // ((n >> s) + 1)
+
+    q += d
+    r -= n * d
+    if r >= n:
+        r -= n
+        q += 1
+
+    return q, r
 
 def _splitHiLo(num, bitIdx):
     '''helper function to split an integer into to ints at a particular bit
     index; this assumes num and bitIdx are ints'''
 
     hi = num >> bitIdx
-    lo = num & ((1 << bitIdx) - 1)
-    return hi, lo
\ No newline at end of file
+    lo = num & _lowBitsMask(bitIdx)
+    return hi, lo
+
+@functools.lru_cache(maxsize=64)
+def _lowBitsMask(bitIdx):
+    '''helper function returning (1 << bitIdx) - 1; building the mask costs as
+    much as the masking itself, and since a division splits at the same few bit
+    indices over and over (they only depend on the size of the divisor) the
+    most recently used masks are cached'''
+
+    return (1 << bitIdx) - 1
+
+def _calibrate():
+    '''measure the bailout thresholds on this machine and return them as a dict
+    mapping the names of the threshold variables to their values; thresholds
+    that couldn't be measured reliably are left out.
+
+    For each operation, the whole algorithm is timed with each threshold from
+    1024 up to 65536 bits (16384 for the conversion) on random operands of
+    1536 up to 98304 bits, so that every threshold is just below some of the
+    operand sizes. Each timing is the best of 5 runs of enough calls to take a
+    couple of milliseconds, and the runs for the different thresholds are
+    interleaved so that they all see the same changes in machine load. The
+    times for each operand size are scaled by the best time for that size, so
+    that every size counts the same, and summed; near the crossover the
+    thresholds are about equally good, so the smallest threshold within 3% of
+    the best sum is picked rather than the best one (which is then down to
+    noise). This is all done twice, and a threshold is only returned if both
+    rounds agree on it. The division is measured first, since the other two
+    use it'''
+
+    def fastest(name, thresholds, calls):
+        costs = [0] * len(thresholds)
+        for call in calls:
+            number = max(1, int(0.002 / max(timeit.timeit(call, number=1), 1e-6)))
+            times = [float('inf')] * len(thresholds)
+            for _ in range(5):
+                for i, threshold in enumerate(thresholds):
+                    globals()[name] = threshold
+                    times[i] = min(times[i], timeit.timeit(call, number=number))
+
+            for i, t in enumerate(times):
+                costs[i] += t / min(times)
+
+        return next(threshold for threshold, cost in zip(thresholds, costs)
+            if cost <= 1.03 * min(costs))
+
+    thresholds = [1024 << i for i in range(7)]
+    sizes = [1536 << i for i in range(7)]
+
+    # a generator of its own, so that calibrating (which can happen at import)
+    # doesn't change the state of the caller's random module
+    rng = random.Random()
+
+    def divModCall(bits):
+        n = rng.getrandbits(bits) | (1 << (bits - 1))
+        m = rng.getrandbits(2 * bits)
+        return lambda: _divModPositiveArgs(m, n)
+
+    def sqrtCall(bits):
+        n = rng.getrandbits(bits) | (1 << (bits - 1))
+        return lambda: _sqrtRemPositiveInt(n)
+
+    def strCall(bits):
+        n = rng.getrandbits(bits) | (1 << (bits - 1))
+        return lambda: _toBase10String(n)
+
+    # the builtin str refuses ints of more than 4300 digits by default (see
+    # sys.set_int_max_str_digits), so the base case of the conversion has to
+    # stay at 4096 digits, which is at most 16384 bits
+    measurements = [
+        ('_DIVMOD_BAILOUT_BITS', thresholds, divModCall),
+        ('_SQRT_BAILOUT_BITS', thresholds, sqrtCall),
+        ('_STR_BAILOUT_BITS', thresholds[:5], strCall),
+    ]
+
+    results = {}
+    for name, candidates, makeCall in measurements:
+        default = globals()[name]
+        picks = [fastest(name, candidates, [makeCall(bits) for bits in sizes])
+            for _ in range(2)]
+
+        if picks[0] == picks[1]:
+            results[name] = picks[0]
+        globals()[name] = results.get(name, default)
+
+    return results
+
+def _cpuName():
+    '''return a name for the cpu, for telling apart the thresholds of machines
+    that share a home directory; on linux platform.processor() is usually
+    empty or just the architecture, so the name is read from /proc/cpuinfo:
+    x86 has a model name there, while on most arm machines the cpu is only
+    identified by its Hardware, CPU implementer and CPU part fields. If none
+    of those can be found, the host name is used, so machines without a cpu
+    name at least don't share thresholds with each other'''
+
+    fields = {}
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                fields.setdefault(name.strip(), value.strip())
+    except OSError:
+        pass
+
+    if fields.get('model name'):
+        return fields['model name']
+
+    armName = ' '.join(fields[name]
+        for name in ('Hardware', 'CPU implementer', 'CPU part') if fields.get(name))
+
+    return armName or platform.processor() or platform.node() or 'unknown cpu'
+
+def _loadThresholds():
+    '''set the bailout thresholds to the ones saved in _THRESHOLDS_CACHE for this
+    python version and cpu, running _calibrate and saving its results there
+    first if there aren't any yet'''
+
+    key = ' '.join((platform.python_implementation(), platform.python_version(),
+        platform.machine(), _cpuName()))
+
+    try:
+        with open(_THRESHOLDS_CACHE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    # anything that isn't what this function writes is thrown away (or for the
+    # entry of this machine, measured again)
+    if not isinstance(cache, dict):
+        cache = {}
+
+    if not isinstance(cache.get(key), dict):
+        cache[key] = _calibrate()
+        try:
+            os.makedirs(os.path.dirname(_THRESHOLDS_CACHE), exist_ok=True)
+            with open(_THRESHOLDS_CACHE, 'w') as f:
+                json.dump(cache, f, indent=4)
+        except OSError:
+            # not being able to save them just means calibrating again next time
+            pass
+
+    # thresholds that _calibrate couldn't measure reliably keep their defaults
+    for name in ('_DIVMOD_BAILOUT_BITS', '_SQRT_BAILOUT_BITS', '_STR_BAILOUT_BITS'):
+        if isinstance(cache[key].get(name), int):
+            globals()[name] = cache[key][name]
+
+# calibrating takes a few seconds, so it's only done on request; set
+# PYFASTBIGINT_CALIBRATE=1 to use (and the first time measure) the thresholds
+# for this machine
+if os.environ.get('PYFASTBIGINT_CALIBRATE'):
+    _loadThresholds()
@@ -1,10 +1,17 @@
 from pyFastBigInt import (
     fastBigIntDivMod,
     fastBigIntStrBase10,
-    fastBigIntFloorSqrt
+    fastBigIntFloorSqrt,
+    fastBigIntSqrtRem
 )
 import time
 import math # for math.isqrt
+import sys
+
+# python 3.11+ refuses to convert ints of more than 4300 digits with str unless
+# the limit is lifted; the builtin str is what the conversion is tested against
+if hasattr(sys, 'set_int_max_str_digits'):
+    sys.set_int_max_str_digits(0)
 
 def tblPrintRow(elems, ljust=False, width=20):
     row = '|'
@@ -56,6 +63,39 @@ def divModTest():
 
     print()
 
+def longDivModTest():
+    print("divmod(num,den) vs pyFastBigInt.fastBigIntDivMod(num,den) for long quotients:")
+    print()
+    tblPrintRow(["num.bit_length()", "den.bit_length()", "builtin time (s)",
+        "pyFastBigInt time (s)"], ljust=True, width=24)
+    tblPrintDivider(4, 24)
+
+    # these take the reciprocal division path: the divisors are between 4096
+    # and 2**17 bits (and not all multiples of 8 bits) and the numerators are
+    # about 30 times longer
+    for i in range(9, 14):
+        num = 487**(30 * 2**i)
+        den = 486**(2**i)
+
+        start = time.time()
+        builtinQuotient, builtinRemainder = divmod(num, den)
+        end = time.time()
+        builtinTime = end - start
+
+        start = time.time()
+        customQuotient, customRemainder = fastBigIntDivMod(num, den)
+        end = time.time()
+        customTime = end - start
+
+        assert(builtinQuotient == customQuotient)
+        assert(builtinRemainder == customRemainder)
+        assert(fastBigIntDivMod(-num, den) == divmod(-num, den))
+
+        tblPrintRow([num.bit_length(), den.bit_length(), builtinTime, customTime],
+            width=24)
+
+    print()
+
 def strTest():
     print("str(val) vs pyFastBigInt.fastBigIntStrBase10(val):")
     print()
@@ -103,11 +143,13 @@ def sqrtTest():
         customTime = end-start
 
         assert(builtinSqrt == customSqrt)
+        assert(fastBigIntSqrtRem(val) == (builtinSqrt, val - builtinSqrt**2))
     
         tblPrintRow([val.bit_length(), builtinTime, customTime], width=24)
 
     print()
 
 divModTest()
+longDivModTest()
 strTest()
 sqrtTest()